@@ -1,5 +1,9 @@
+import time
 from datetime import datetime as dt, timezone, timedelta
-import requests
+from urllib.parse import urlencode
+
+import geohash
+from transport import default_transport
 
 WMO_CODES = {
     0: "☼ Clear sky",
@@ -34,14 +38,54 @@ WMO_CODES = {
 }
 
 
+OPEN_METEO_API = "https://api.open-meteo.com/v1/forecast"
+HOURLY_FIELDS = "temperature_2m,precipitation_probability,weathercode"
+TIMEZONE = "Asia/Manila"  # UTC+8, matches Forecast.tz
+
+# Drying windows checked by today() and week(), as [start, end) hours.
+WINDOWS: dict[str, tuple[int, int]] = {"morning": (6, 11), "noon": (11, 15)}
+
+WEEK_DAYS = 7  # Open-Meteo allows up to 16
+WEEK_CACHE_TTL = 60 * 60  # seconds
+
+# {(cell, date): (expires_at, weathercodes)}
+_week_cache: dict[tuple[str, str], tuple[float, list[int]]] = dict()
+
+_shared_transport = None
+
+
+def shared_transport():
+    # One transport per process, selected by env vars (see transport.py)
+    global _shared_transport
+
+    if _shared_transport == None:
+        _shared_transport = default_transport()
+
+    return _shared_transport
+
+
 class Forecast:
-    def __init__(self, lon: float, lat: float) -> None:
+    def __init__(self, lon: float, lat: float, transport=None) -> None:
         self.forecast: dict = dict()  # 3-day forecast
         self.lon: float = lon
         self.lat: float = lat
         self.tz: timezone = timezone(timedelta(hours=8))
+        self._transport = transport if transport != None else shared_transport()
+
+    def api_url(self, hourly: str = HOURLY_FIELDS, **params) -> str:
+        """
+        Builds an Open-Meteo URL asking only for the given hourly fields.
+        Extra params are passed as is, e.g. forecast_days=3 or start_hour/end_hour.
+        """
+        query: dict = {
+            "latitude": self.lat,
+            "longitude": self.lon,
+            "hourly": hourly,
+            "timezone": TIMEZONE,
+            **params,
+        }
 
-        self._OPEN_METEO_API = f"https://api.open-meteo.com/v1/forecast?latitude={self.lat}&longitude={self.lon}&hourly=temperature_2m,precipitation_probability,weathercode&forecast_days=3"
+        return f"{OPEN_METEO_API}?{urlencode(query, safe=',:')}"
 
     def __str__(self) -> str:
         text: str = "FORECAST\n"
@@ -72,9 +116,10 @@ class Forecast:
 
         return text
 
-    def get_weather(self) -> None:
+    def get_weather(self, start: dt | None = None, end: dt | None = None) -> None:
         """
-        OpenMeteo API Call to get 2 days worth of hourly weather data.
+        OpenMeteo API Call to get hourly weather data from start to end (inclusive).
+        Without start and end, gets 3 days worth of hourly weather data.
 
         Keys:
             'time',
@@ -90,36 +135,20 @@ class Forecast:
             'precipitation_probability': [0,23,40,..]
         }
         """
-        response: requests.Response = requests.get(self._OPEN_METEO_API)
-        weather_data: dict = response.json()["hourly"]
-        # weather_data: dict = response.json()
-        # print(weather_data)
-
-        self.forecast = weather_data
-
-    def extract_forecast(self, source: dict, start_idx: int, end_idx: int) -> dict:
-        """
-        Extracts a new dictionary from source dictionary based on the start and end indices.
-        """
-        extracted_forecast: dict = dict()
-
-        for k, v in source.items():
-            if k == "time":
-                extracted_forecast.update({"time": v[start_idx:end_idx]})
-            elif k == "weathercode":
-                extracted_forecast.update({"weathercode": v[start_idx:end_idx]})
-            elif k == "temperature_2m":
-                extracted_forecast.update({"temperature_2m": v[start_idx:end_idx]})
-            elif k == "precipitation_probability":
-                extracted_forecast.update(
-                    {"precipitation_probability": v[start_idx:end_idx]}
-                )
+        if start == None or end == None:
+            url: str = self.api_url(forecast_days=3)
+        else:
+            url: str = self.api_url(
+                start_hour=start.strftime("%Y-%m-%dT%H:%M"),
+                end_hour=end.strftime("%Y-%m-%dT%H:%M"),
+            )
 
-        return extracted_forecast
+        # The "hourly" object already is the forecast structure, keep it as is.
+        self.forecast = self._transport.get(url)["hourly"]
 
-    def can_laba(self, forecast: dict) -> bool:
+    def can_laba(self, weathercodes: list[int]) -> bool:
         """
-        Make sense of the 5-hour forecast data
+        Make sense of the 5-hour forecast weathercodes
         1. Check for specific weather windows and precipitation probability (pp).
             Sunny - 2 hour window (wmo 0)
             Mainly clear - 3 hour window (wmo 1)
@@ -133,7 +162,7 @@ class Forecast:
         score: int = 0
         decision: bool = True
 
-        for wmo_code in forecast["weathercode"]:
+        for wmo_code in weathercodes:
             score += wmo_code
 
             if wmo_code > 4:
@@ -150,29 +179,19 @@ class Forecast:
     def now(self) -> str:
         text: str = "CURRENT FORECAST\n"
 
-        self.get_weather()  # Get fresh weather data
-
-        now: dt = dt.now(tz=self.tz)  # Get current datetime
+        now: dt = self._transport.now(self.tz)  # Get current datetime
 
         # Get forecast of next 6 hours if minute > 30 minutes. Else, 5 hours
         if now.minute > 30:
-            next_idx: int = 6
-            now: dt = dt(now.year, now.month, now.day, now.hour + 1)
+            hours: int = 6
+            now = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
         else:
-            next_idx: int = 5
-            now: dt = dt(now.year, now.month, now.day, now.hour)
-
-        # Convert datetime object to isoformat. Removing seconds.
-        iso_now: dt = now.isoformat()[:-3]
+            hours: int = 5
+            now = now.replace(minute=0, second=0, microsecond=0)
 
-        # Get index of current time in forecast.
-        now_idx: int = self.forecast["time"].index(iso_now)
-
-        next_idx += now_idx  # Index range to extract 5 or 6-hour forecast.
-
-        now_forecast = self.extract_forecast(
-            self.forecast, now_idx, next_idx
-        )  # Get forecast data starting from now_idx to next_idx
+        # Only fetch the 5 or 6 hours we display.
+        self.get_weather(now, now + timedelta(hours=hours - 1))
+        now_forecast: dict = self.forecast
 
         # Display forecast
         text += self.display_forecast(now_forecast) + "\n"
@@ -189,38 +208,154 @@ class Forecast:
             return text
         else:
             # Can I laba now?
-            if self.can_laba(now_forecast):
+            if self.can_laba(now_forecast["weathercode"]):
                 text += "Yes, you can laba right now."
                 return text
             else:
                 text += "No, you can't laba right now"
                 return text
 
-    def today(self) -> str:
-        today = dt.now(tz=self.tz)
+    def today_verdict(self) -> tuple[bool, str]:
+        """
+        Decides if you can laba today.
+        Returns the decision and the rendered message.
+        """
+        today = self._transport.now(self.tz)
         text: str = f"TODAY'S FORECAST ({today.date()})\n"
-        self.get_weather()
 
-        morning_forecast: dict = self.extract_forecast(self.forecast, 6, 11)
-        noon_forecast: dict = self.extract_forecast(self.forecast, 11, 15)
+        # Only fetch the hours covered by the drying windows.
+        first_hour: int = min(start for start, _ in WINDOWS.values())
+        last_hour: int = max(end for _, end in WINDOWS.values())
+        midnight: dt = today.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        self.get_weather(
+            midnight + timedelta(hours=first_hour),
+            midnight + timedelta(hours=last_hour - 1),
+        )
 
-        text += self.display_forecast(morning_forecast)
-        text += self.display_forecast(noon_forecast)
+        # The response is exactly the drying windows, display it as is.
+        text += self.display_forecast(self.forecast)
 
-        # Can I laba today?
-        if self.can_laba(morning_forecast) or self.can_laba(noon_forecast):
+        # Can I laba today? Check each window on a slice of the weathercodes.
+        weathercodes: list[int] = self.forecast["weathercode"]
+
+        if any(
+            self.can_laba(weathercodes[start - first_hour : end - first_hour])
+            for start, end in WINDOWS.values()
+        ):
             text += "\nYou can laba today!"
-            return text
+            return True, text
         else:
             text += (
                 "\nYou cannot laba today. The clothes will not dry. Try again tomorrow."
             )
-            return text
+            return False, text
+
+    def today(self) -> str:
+        _, text = self.today_verdict()
+        return text
+
+    def score_days(
+        self, weathercodes: list[int], now_hour: float = 0.0
+    ) -> list[tuple[int, str, float]]:
+        """
+        Applies the can_laba rules to every day's drying windows in one pass.
+        Prefix sums over the hourly weathercodes make each window O(1).
+        Windows of day 0 that started before now_hour are skipped, since clothes
+        hung now would not get the full window to dry.
+
+        Returns passing windows as (day_idx, window, score), best first.
+        Score is the mean weathercode per hour, so windows of different
+        lengths compare fairly. Lower score means clearer skies.
+        """
+        code_sums: list[int] = [0]
+        bad_hours: list[int] = [0]  # Hours with wmo > 4 (fog, rain, ...)
+
+        for wmo_code in weathercodes:
+            code_sums.append(code_sums[-1] + wmo_code)
+            bad_hours.append(bad_hours[-1] + (wmo_code > 4))
+
+        ranked: list[tuple[int, str, float]] = []
+
+        for day_idx in range(len(weathercodes) // 24):
+            best: tuple[int, str, float] | None = None
+
+            for window, (start, end) in WINDOWS.items():
+                if day_idx == 0 and start < now_hour:
+                    continue
+
+                start += day_idx * 24
+                end += day_idx * 24
+
+                total: int = code_sums[end] - code_sums[start]
+                score: float = total / (end - start)
+
+                # Same threshold as can_laba, on the raw sum.
+                if bad_hours[end] - bad_hours[start] == 0 and total <= 15:
+                    if best == None or score < best[2]:
+                        best = (day_idx, window, score)
+
+            if best != None:
+                ranked.append(best)
+
+        ranked.sort(key=lambda day: (day[2], day[0]))
+
+        return ranked
+
+    def week(self) -> str:
+        """
+        Ranks the best laundry days of the next WEEK_DAYS days.
+        The fetched weathercodes are cached per forecast cell; ranking is
+        redone on every call so windows that already started drop out.
+        """
+        now: dt = self._transport.now(self.tz)
+        today = now.date()
+        key: tuple[str, str] = (geohash.encode(self.lon, self.lat), today.isoformat())
+
+        cached = _week_cache.get(key)
+        if cached != None and cached[0] > time.monotonic():
+            weathercodes: list[int] = cached[1]
+        else:
+            url: str = self.api_url(hourly="weathercode", forecast_days=WEEK_DAYS)
+            weathercodes: list[int] = self._transport.get(url)["hourly"]["weathercode"]
+            _week_cache[key] = (time.monotonic() + WEEK_CACHE_TTL, weathercodes)
+
+            # Drop expired entries so the cache doesn't grow forever.
+            expired: float = time.monotonic()
+            for k in [k for k, v in _week_cache.items() if v[0] <= expired]:
+                del _week_cache[k]
+
+        ranked = self.score_days(weathercodes, now.hour + now.minute / 60)
+
+        last_day = today + timedelta(days=WEEK_DAYS - 1)
+        text: str = f"WEEK PLANNER ({today} to {last_day})\n"
+
+        if not ranked:
+            text += "\nNo good laundry days this week. The clothes will not dry."
+        else:
+            text += "\nBest laundry days:\n"
+            for rank, (day_idx, window, score) in enumerate(ranked, start=1):
+                day = today + timedelta(days=day_idx)
+                start, end = WINDOWS[window]
+                text += (
+                    f"{rank}. {day.strftime('%a')} {day}  {start:02d}:00-{end:02d}:00\n"
+                )
+
+        return text
 
 
 if __name__ == "__main__":
+    # FORECAST_RECORD_DIR=recordings python forecast.py     record once (online)
+    # FORECAST_REPLAY_DIR=recordings python forecast.py     replay (offline)
+    # FORECAST_REPLAY_DIR=fixtures/forecast python forecast.py  offline check
+    import timeit
+
     lon = 121.1222
     lat = 14.5786
     f = Forecast(lon, lat)
     print(f.now())
     print(f.today())
+    print(f.week())
+
+    print(f"now():   {timeit.timeit(f.now, number=10) / 10:.4f}s")
+    print(f"today(): {timeit.timeit(f.today, number=10) / 10:.4f}s")
@@ -0,0 +1,83 @@
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE_MAP = {c: i for i, c in enumerate(_BASE32)}
+
+# 5 characters is a ~4.9km x 4.9km cell, finer than Open-Meteo's model grid.
+PRECISION = 5
+
+
+def encode(lon: float, lat: float, precision: int = PRECISION) -> str:
+    """
+    Encodes a coordinate into a geohash string.
+    Nearby users share the same geohash, so they can share one forecast.
+    """
+    lon_range: list[float] = [-180.0, 180.0]
+    lat_range: list[float] = [-90.0, 90.0]
+
+    geohash: list[str] = []
+    bits: int = 0
+    bit_count: int = 0
+    even: bool = True  # Even bits encode longitude, odd bits latitude
+
+    while len(geohash) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            geohash.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(geohash)
+
+
+def decode(geohash: str) -> tuple[float, float]:
+    """
+    Decodes a geohash string into the (lon, lat) center of its cell.
+    """
+    lon_range: list[float] = [-180.0, 180.0]
+    lat_range: list[float] = [-90.0, 90.0]
+    even: bool = True
+
+    for c in geohash:
+        value = _DECODE_MAP[c]
+
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+
+            if bit:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+
+            even = not even
+
+    lon: float = (lon_range[0] + lon_range[1]) / 2
+    lat: float = (lat_range[0] + lat_range[1]) / 2
+
+    return lon, lat
+
+
+if __name__ == "__main__":
+    lon = 121.1222
+    lat = 14.5786
+    cell = encode(lon, lat)
+    print(cell, decode(cell))
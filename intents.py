@@ -0,0 +1,56 @@
+import re
+
+"""
+    Maps free-text messages to bot intents with one precompiled regex.
+    Anything that doesn't match is ignored instead of echoed back.
+"""
+
+INTENTS: dict[str, tuple[str, ...]] = {
+    "now": ("can i laba", "can i laba now", "laba now"),
+    "today": ("can i laba today", "laba today"),
+    "week": ("can i laba this week", "laba this week"),
+    "no_location": ("don't share location",),
+}
+
+# Only answered in private chats; in groups they would change the group's row.
+PRIVATE_INTENTS: set[str] = {"no_location"}
+
+_KEYWORDS: dict[str, str] = {
+    keyword: intent for intent, keywords in INTENTS.items() for keyword in keywords
+}
+
+
+def _keyword_pattern(keyword: str) -> str:
+    # Phones may send a curly apostrophe.
+    return re.escape(keyword).replace("'", "['’]")
+
+
+# Longest keywords first, so "can i laba today" wins over "can i laba".
+_INTENT_RE: re.Pattern = re.compile(
+    r"\b(?:"
+    + "|".join(_keyword_pattern(k) for k in sorted(_KEYWORDS, key=len, reverse=True))
+    + r")\b",
+    re.IGNORECASE,
+)
+
+
+def match_intent(text: str, mention: str | None = None) -> str | None:
+    """
+    Returns the intent of text, or None.
+    If mention is given (group chats), text must contain it, e.g. "@canilababot",
+    and PRIVATE_INTENTS are ignored.
+    """
+    if mention != None and mention.lower() not in text.lower():
+        return None
+
+    match = _INTENT_RE.search(text)
+
+    if match == None:
+        return None
+
+    intent: str = _KEYWORDS[match.group(0).lower().replace("’", "'")]
+
+    if mention != None and intent in PRIVATE_INTENTS:
+        return None
+
+    return intent
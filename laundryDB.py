@@ -1,21 +1,25 @@
 import sqlite3
 import logging
 
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
-# Set higher logging level for httpx to avoid all GET and POST requests being logged
-logging.getLogger("httpx").setLevel(logging.WARNING)
+import geohash
+from weekday import mask_to_days
+
 logger = logging.getLogger(__name__)
 
 
 class LaundryDB:
+    # Databases whose schema was already set up by this process.
+    _ready_dbs: set[str] = set()
+
     def __init__(self, dbname="user_config.sqlite") -> None:
         try:
+            self._dbname: str = dbname
             self._conn: sqlite3.Connection = sqlite3.connect(dbname)
-            self._setup_table()
-            logger.info("Connection to DB successful.")
+
+            if dbname not in LaundryDB._ready_dbs:
+                self._setup_table()
+
+            logger.debug("Connection to DB successful.")
         except Exception as e:
             logger.error(e)
 
@@ -25,19 +29,60 @@ class LaundryDB:
                user_id INT PRIMARY KEY NOT NULL,
                laundry_days TEXT,
                lon FLOAT,
-               lat FLOAT
+               lat FLOAT,
+               cell TEXT
                 )
                """
         try:
             self._conn.execute(qry)
+            self._migrate_cell_column()
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_user_laundry_days_cell ON user_laundry_days (cell)"
+            )
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cell_verdicts (
+               cell TEXT NOT NULL,
+               date TEXT NOT NULL,
+               can_laba INT NOT NULL,
+               message TEXT NOT NULL,
+               PRIMARY KEY (cell, date)
+                )
+               """)
             self._conn.commit()
-            logger.info("Created user_laundry_days table")
+            LaundryDB._ready_dbs.add(self._dbname)
+            logger.info("Created user_laundry_days and cell_verdicts tables")
         except Exception as e:
             logger.error(e)
 
+    def _migrate_cell_column(self) -> None:
+        """
+        Adds the cell column to tables created before forecast cells existed,
+        then backfills it from the stored coordinates.
+        """
+        cursor: sqlite3.Cursor = self._conn.execute(
+            "PRAGMA table_info(user_laundry_days)"
+        )
+        columns: list[str] = [row[1] for row in cursor.fetchall()]
+
+        if "cell" in columns:
+            return
+
+        self._conn.execute("ALTER TABLE user_laundry_days ADD COLUMN cell TEXT")
+
+        cursor = self._conn.execute(
+            "SELECT user_id, lon, lat FROM user_laundry_days WHERE lon IS NOT NULL AND lat IS NOT NULL"
+        )
+        args: list[tuple[str, int]] = [
+            (geohash.encode(lon, lat), user_id) for user_id, lon, lat in cursor
+        ]
+        self._conn.executemany(
+            "UPDATE user_laundry_days SET cell=? WHERE user_id=?", args
+        )
+        logger.info("Added cell column. Backfilled %d users.", len(args))
+
     def close(self) -> None:
         self._conn.close()
-        logger.info("Connection to DB closed.")
+        logger.debug("Connection to DB closed.")
 
     def add_user(self, user_id: int):
         qry: str = "INSERT INTO user_laundry_days (user_id) VALUES (?)"
@@ -46,7 +91,7 @@ class LaundryDB:
         try:
             self._conn.execute(qry, args)
             self._conn.commit()
-            logger.info(f"Added user {user_id}")
+            logger.info("Added user %s", user_id)
         except Exception as e:
             logger.error(e)
 
@@ -56,13 +101,13 @@ class LaundryDB:
 
         self._conn.execute(qry, args)
         self._conn.commit()
-        logger.info(f"Entry of {user_id} deleted.")
+        logger.info("Entry of %s deleted.", user_id)
 
     def dump(self) -> list[any]:
         qry: str = "SELECT * FROM user_laundry_days"
         cursor: sqlite3.Cursor = self._conn.execute(qry)
         data: list[any] = cursor.fetchall()
-        logger.debug(data)
+        logger.debug("%s", data)
 
         return data
 
@@ -80,10 +125,10 @@ class LaundryDB:
 
             self._conn.execute(qry, args)
             self._conn.commit()
-            logger.info(f"{days} set for {user_id}.")
+            logger.info("%s set for %s.", days, user_id)
 
         else:
-            logger.debug(f"{user_id} already exists. Updating instead.")
+            logger.debug("%s already exists. Updating instead.", user_id)
             self.update_day(user_id, days)
 
     def update_day(self, user_id: int, days: str) -> None:
@@ -96,10 +141,10 @@ class LaundryDB:
 
             self._conn.execute(qry, args)
             self._conn.commit()
-            logger.info(f"Updated to {days} for {user_id}.")
+            logger.info("Updated to %s for %s.", days, user_id)
 
         else:
-            logger.debug(f"{user_id} does not exist. Adding instead.")
+            logger.debug("%s does not exist. Adding instead.", user_id)
             self.set_day(user_id, days)
 
     def clear_day(self, user_id: int) -> None:
@@ -108,18 +153,15 @@ class LaundryDB:
 
         self._conn.execute(qry, args)
         self._conn.commit()
-        logger.info(f"Cleared laundry days column of {user_id}.")
+        logger.info("Cleared laundry days column of %s.", user_id)
 
-    def save_day(self, user_id: int, week_dict: dict) -> None:
-        # Parse dictionary
-        days: list[str] = [day for day, value in week_dict.items() if value == True]
-        days: str = " ".join(days)
+    def save_day(self, user_id: int, days_mask: int) -> None:
+        # Parse 7-bit day mask
+        days: str = mask_to_days(days_mask)
 
         # Set/update
         self.set_day(user_id, days)
 
-        logger.info(days)
-
     def get_day(self, user_id) -> any:
         try:
             qry: str = "SELECT laundry_days FROM user_laundry_days WHERE user_id=?"
@@ -141,18 +183,27 @@ class LaundryDB:
                     UPDATE user_laundry_days 
                     SET 
                         lon=?, 
-                        lat=? 
+                        lat=?,
+                        cell=? 
                     WHERE user_id=?"""
+        cell: str = geohash.encode(lon, lat)
         args = (
             lon,
             lat,
+            cell,
             user_id,
         )
 
         self._conn.execute(qry, args)
         self._conn.commit()
 
-        logger.info(f"Successfully saved user {user_id} location ({lon}, {lat})")
+        logger.info(
+            "Successfully saved user %s location (%s, %s) in cell %s",
+            user_id,
+            lon,
+            lat,
+            cell,
+        )
 
     def get_lon(self, user_id: int) -> float | None:
         try:
@@ -161,7 +212,7 @@ class LaundryDB:
 
             cursor: sqlite3.Cursor = self._conn.execute(qry, args)
             data = cursor.fetchone()
-            return data[0]
+            return data[0] if data else None
 
         except sqlite3.OperationalError as e:
             logger.error(e)
@@ -174,14 +225,134 @@ class LaundryDB:
 
             cursor: sqlite3.Cursor = self._conn.execute(qry, args)
             data = cursor.fetchone()
-            return data[0]
+            return data[0] if data else None
 
         except sqlite3.OperationalError as e:
             logger.error(e)
             return None
 
+    def get_cell(self, user_id: int) -> str | None:
+        try:
+            qry: str = "SELECT cell FROM user_laundry_days WHERE user_id=?"
+            args: tuple[int] = (user_id,)
+
+            cursor: sqlite3.Cursor = self._conn.execute(qry, args)
+            data = cursor.fetchone()
+            return data[0] if data else None
+
+        except sqlite3.OperationalError as e:
+            logger.error(e)
+            return None
+
+    # --------------------CELL FUNCTIONS
+
+    def cell_report(self) -> dict:
+        """
+        Counts users per forecast cell.
+        The deduplication ratio is users per cell, i.e. how many forecast
+        calls one cell saves compared to one call per user.
+
+        Dictionary structure:
+        {
+            'cells': {'wdw4u': 12, 'wdw4v': 3, ...},
+            'users': 15,
+            'ratio': 7.5
+        }
+        """
+        qry: str = """
+                SELECT cell, COUNT(*) 
+                FROM user_laundry_days 
+                WHERE cell IS NOT NULL 
+                GROUP BY cell 
+                ORDER BY COUNT(*) DESC"""
+        cursor: sqlite3.Cursor = self._conn.execute(qry)
+        cells: dict[str, int] = dict(cursor.fetchall())
+
+        users: int = sum(cells.values())
+        ratio: float = users / len(cells) if cells else 0.0
+
+        logger.info("%d users in %d cells (ratio %.2f).", users, len(cells), ratio)
+
+        return {"cells": cells, "users": users, "ratio": ratio}
+
+    def get_cells(self) -> list[str]:
+        qry: str = "SELECT DISTINCT cell FROM user_laundry_days WHERE cell IS NOT NULL"
+        cursor: sqlite3.Cursor = self._conn.execute(qry)
+
+        return [row[0] for row in cursor.fetchall()]
+
+    # --------------------VERDICT FUNCTIONS
+
+    def save_verdicts(self, date: str, verdicts: list[tuple[str, bool, str]]) -> None:
+        """
+        Stores each cell's daily verdict and pre-rendered message.
+        verdicts: [(cell, can_laba, message), ...]
+        """
+        qry: str = """
+                INSERT OR REPLACE INTO cell_verdicts (cell, date, can_laba, message) 
+                VALUES (?, ?, ?, ?)"""
+        args: list[tuple[str, str, bool, str]] = [
+            (cell, date, can_laba, message) for cell, can_laba, message in verdicts
+        ]
+
+        self._conn.executemany(qry, args)
+        # Verdicts from previous days are never read again.
+        self._conn.execute("DELETE FROM cell_verdicts WHERE date<?", (date,))
+        self._conn.commit()
+
+        logger.info("Saved %d verdicts for %s.", len(args), date)
+
+    def get_missing_cells(self, date: str, weekday: str) -> list[str]:
+        """
+        Cells with a user due on weekday but no verdict for date yet.
+        """
+        qry: str = """
+                SELECT DISTINCT u.cell 
+                FROM user_laundry_days u 
+                LEFT JOIN cell_verdicts v ON v.cell=u.cell AND v.date=? 
+                WHERE u.cell IS NOT NULL 
+                    AND v.cell IS NULL 
+                    AND ' ' || u.laundry_days || ' ' LIKE ?"""
+        args: tuple[str, str] = (date, f"% {weekday} %")
+
+        cursor: sqlite3.Cursor = self._conn.execute(qry, args)
+
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_due_notifications(
+        self, date: str, weekday: str
+    ) -> list[tuple[int, str | None]]:
+        """
+        Joins users whose laundry days include weekday against the verdicts of date.
+        Users without a verdict (no location, failed forecast) get None as message.
+        Returns [(user_id, message), ...]
+        """
+        qry: str = """
+                SELECT u.user_id, v.message 
+                FROM user_laundry_days u 
+                LEFT JOIN cell_verdicts v ON v.cell=u.cell AND v.date=? 
+                WHERE ' ' || u.laundry_days || ' ' LIKE ?"""
+        args: tuple[str, str] = (date, f"% {weekday} %")
+
+        cursor: sqlite3.Cursor = self._conn.execute(qry, args)
+        data: list[tuple[int, str | None]] = cursor.fetchall()
+        logger.debug("%s", data)
+
+        return data
+
 
 if __name__ == "__main__":
+    from logconfig import setup_logging
+
+    setup_logging()
+
     db = LaundryDB()
     print(db.dump())
+
+    report = db.cell_report()
+    for cell, count in report["cells"].items():
+        print(f"{cell:<7}{count}")
+    print(
+        f"{report['users']} users / {len(report['cells'])} cells = {report['ratio']:.2f}"
+    )
     db.close()
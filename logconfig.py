@@ -0,0 +1,108 @@
+import os
+import queue
+import atexit
+import logging
+import logging.handlers
+from collections import Counter
+
+"""
+    Non-blocking logging. Handlers only put records on a queue; a background
+    thread formats and writes them.
+
+    Env vars:
+        LOG_LEVEL=INFO                          root level
+        LOG_LEVELS=laundryDB=WARNING,main=DEBUG per-module levels
+        LOG_SAMPLE_RATE=10                      keep 1 in N repeats of each DEBUG/INFO message
+"""
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Noisy third-party loggers, overridable with LOG_LEVELS.
+DEFAULT_LEVELS: dict[str, str] = {"httpx": "WARNING", "apscheduler": "WARNING"}
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that doesn't format records before queueing them, so
+    %-style messages are only built on the listener thread.
+    Args must not be mutated after the log call.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class SampleFilter(logging.Filter):
+    """
+    Lets through 1 in rate records per message template (record.msg) below WARNING.
+    Warnings, errors and pre-formatted messages (no args) always pass.
+    """
+
+    # Counts are reset past this many templates, so memory stays bounded.
+    MAX_TEMPLATES = 1024
+
+    def __init__(self, rate: int) -> None:
+        super().__init__()
+        self.rate: int = rate
+        self.counts: Counter = Counter()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 1 or record.levelno >= logging.WARNING:
+            return True
+
+        # Without args, record.msg is a formatted string, not a template.
+        if not record.args:
+            return True
+
+        if len(self.counts) >= self.MAX_TEMPLATES:
+            self.counts.clear()
+
+        key = (record.name, record.msg)
+        self.counts[key] += 1
+
+        return self.counts[key] % self.rate == 1
+
+
+def parse_levels(levels: str) -> dict[str, str]:
+    # "laundryDB=WARNING,main=DEBUG" -> {"laundryDB": "WARNING", "main": "DEBUG"}
+    parsed: dict[str, str] = dict()
+
+    for item in levels.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            parsed[name.strip()] = level.strip().upper()
+
+    return parsed
+
+
+def setup_logging() -> None:
+    """
+    Configures the root logger once per process. Safe to call more than once.
+    """
+    global _listener
+
+    if _listener != None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SampleFilter(int(os.getenv("LOG_SAMPLE_RATE", "1"))))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    levels: dict[str, str] = DEFAULT_LEVELS | parse_levels(os.getenv("LOG_LEVELS", ""))
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+    # Flush queued records on shutdown.
+    atexit.register(_listener.stop)
@@ -1,6 +1,11 @@
+import time as timer
+
+_IMPORT_STARTED: float = timer.perf_counter()
+
 import os
+import asyncio
 import logging
-from datetime import time, timezone, timedelta
+from datetime import datetime as dt, time, timezone, timedelta
 from typing import Final
 
 from telegram import (
@@ -20,25 +25,97 @@ from telegram.ext import (
     MessageHandler,
     filters,
     Defaults,
+    PicklePersistence,
+    PersistenceInput,
 )
 from dotenv import load_dotenv
 from laundryDB import LaundryDB
-from forecast import Forecast
-from weekday import is_equal
-
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.DEBUG
-)
-# Set higher logging level for httpx to avoid all GET and POST requests being logged
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logger = logging.getLogger(__name__)
+from forecast import Forecast, shared_transport
+from weekday import WEEKDAYS, days_to_mask, weekday_name
+import geohash
+import profiler
+from logconfig import setup_logging
+from intents import match_intent
+from profiler import profiled, profiled_call
+
+# Named explicitly: __name__ is "__main__" when run as python main.py,
+# which LOG_LEVELS=main=... would not match.
+logger = logging.getLogger("main")
 
 BOT_USERNAME: Final = "@canilababot"
 
 SELECTING_ACTION, SET_DAYS, ADDING_DAYS = map(chr, range(3))
 EXIT = ConversationHandler.END
 
+"""
+    Inline keyboards are static, so they are built once at startup.
+    The day picker has one keyboard per 7-bit selection mask (2^7 = 128).
+"""
+
+SET_KEYBOARD: Final = InlineKeyboardMarkup(
+    [
+        [
+            InlineKeyboardButton("Set", callback_data="setdays"),
+            InlineKeyboardButton("Exit", callback_data="exit"),
+        ]
+    ]
+)
+
+UPDATE_KEYBOARD: Final = InlineKeyboardMarkup(
+    [
+        [
+            InlineKeyboardButton("Update", callback_data="setdays"),
+            InlineKeyboardButton("Clear", callback_data="clear"),
+        ],
+        [
+            InlineKeyboardButton("Exit", callback_data="exit"),
+        ],
+    ]
+)
+
+WEEK_KEYBOARD: Final = InlineKeyboardMarkup(
+    [
+        [
+            InlineKeyboardButton("Mon", callback_data="Mon"),
+            InlineKeyboardButton("Tue", callback_data="Tue"),
+            InlineKeyboardButton("Wed", callback_data="Wed"),
+        ],
+        [
+            InlineKeyboardButton("Thu", callback_data="Thu"),
+            InlineKeyboardButton("Fri", callback_data="Fri"),
+            InlineKeyboardButton("Sat", callback_data="Sat"),
+        ],
+        [
+            InlineKeyboardButton("Sun", callback_data="Sun"),
+            InlineKeyboardButton("Exit", callback_data="exit"),
+        ],
+    ]
+)
+
+
+def build_day_keyboard(days_mask: int) -> InlineKeyboardMarkup:
+    buttons = []
+
+    for day, i in WEEKDAYS.items():
+        if days_mask & (1 << i):
+            buttons.append(InlineKeyboardButton(f"✅ {day}", callback_data=day))
+        else:
+            buttons.append(InlineKeyboardButton(f"{day}", callback_data=day))
+
+    # Add Save and Exit buttons at the end.
+    buttons.append(InlineKeyboardButton("Save", callback_data="save"))
+    buttons.append(InlineKeyboardButton("Exit", callback_data="exit"))
+
+    # Prepare and set button placement, alignment.
+    keyboard = [buttons[i : i + 3] for i in range(0, 9, 3)]
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+DAY_KEYBOARDS: Final = tuple(build_day_keyboard(mask) for mask in range(128))
+
+IMPORT_TIME: Final = timer.perf_counter() - _IMPORT_STARTED
+
 """
     Save user timezone information to database.
 """
@@ -97,6 +174,13 @@ async def default_user_location(update: Update, context: ContextTypes.DEFAULT_TY
     user_id = update.message.chat_id
 
     db = LaundryDB()
+
+    # No row yet means /start never ran, so there is nothing to update.
+    if db.get_day(user_id) == None:
+        db.close()
+        await update.message.reply_text("Share your location first with /start.")
+        return
+
     db.save_location(user_id, 121.1222, 14.5786)
     db.close()
 
@@ -111,10 +195,14 @@ async def now_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.chat_id
 
     db = LaundryDB()
-    lon: float = db.get_lon(user_id)
-    lat: float = db.get_lat(user_id)
+    lon: float | None = db.get_lon(user_id)
+    lat: float | None = db.get_lat(user_id)
     db.close()
 
+    if lon == None or lat == None:
+        await update.message.reply_text("Share your location first with /start.")
+        return
+
     forecast = Forecast(lon, lat)
     response_str: str = forecast.now()
     await update.message.reply_text(response_str)
@@ -124,15 +212,37 @@ async def today_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.chat_id
 
     db = LaundryDB()
-    lon: float = db.get_lon(user_id)
-    lat: float = db.get_lat(user_id)
+    lon: float | None = db.get_lon(user_id)
+    lat: float | None = db.get_lat(user_id)
     db.close()
 
+    if lon == None or lat == None:
+        await update.message.reply_text("Share your location first with /start.")
+        return
+
     forecast = Forecast(lon, lat)
     response_str: str = forecast.today()
     await update.message.reply_text(response_str)
 
 
+async def week_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.chat_id
+
+    db = LaundryDB()
+    cell: str | None = db.get_cell(user_id)
+    db.close()
+
+    if cell == None:
+        await update.message.reply_text("Share your location first with /start.")
+        return
+
+    # Forecast for the cell center, so the week cache is shared by the whole cell
+    lon, lat = geohash.decode(cell)
+    forecast = Forecast(lon, lat)
+    response_str: str = forecast.week()
+    await update.message.reply_text(response_str)
+
+
 async def laundrydays_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.chat_id
 
@@ -140,30 +250,11 @@ async def laundrydays_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     set_days = db.get_day(user_id)
 
     if set_days == None:
-        keyboard = [
-            [
-                InlineKeyboardButton("Set", callback_data="setdays"),
-                InlineKeyboardButton("Exit", callback_data="exit"),
-            ]
-        ]
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = SET_KEYBOARD
         text: str = "Set laundry days to be notified if you can laba on those days."
 
     else:
-        keyboard = [
-            [
-                InlineKeyboardButton("Update", callback_data="setdays"),
-                InlineKeyboardButton("Clear", callback_data="clear"),
-            ],
-            [
-                InlineKeyboardButton("Exit", callback_data="exit"),
-            ],
-        ]
-
-        reply_markup = InlineKeyboardMarkup(
-            keyboard,
-        )
+        reply_markup = UPDATE_KEYBOARD
         text: str = f"Your laundry days are set to {set_days[0]}."
 
     db.close()
@@ -177,41 +268,20 @@ async def setdays(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    keyboard = [
-        [
-            InlineKeyboardButton("Mon", callback_data="Mon"),
-            InlineKeyboardButton("Tue", callback_data="Tue"),
-            InlineKeyboardButton("Wed", callback_data="Wed"),
-        ],
-        [
-            InlineKeyboardButton("Thu", callback_data="Thu"),
-            InlineKeyboardButton("Fri", callback_data="Fri"),
-            InlineKeyboardButton("Sat", callback_data="Sat"),
-        ],
-        [
-            InlineKeyboardButton("Sun", callback_data="Sun"),
-            InlineKeyboardButton("Exit", callback_data="exit"),
-        ],
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Start from the saved days, so "Update" shows them already checked.
+    db = LaundryDB()
+    set_days = db.get_day(query.from_user.id)
+    db.close()
 
-    week_dict = {
-        "Mon": False,
-        "Tue": False,
-        "Wed": False,
-        "Thu": False,
-        "Fri": False,
-        "Sat": False,
-        "Sun": False,
-    }
+    days_mask: int = days_to_mask(set_days[0] or "") if set_days != None else 0
+    context.user_data["days_mask"] = days_mask
 
-    context.user_data["week_dict"] = week_dict
+    reply_markup = DAY_KEYBOARDS[days_mask] if days_mask else WEEK_KEYBOARD
 
     await query.edit_message_text(
         "Choose your laundry days.", reply_markup=reply_markup
     )
-    logger.info(context.user_data)
+    logger.debug("User %s started choosing days.", query.from_user.id)
 
     return SET_DAYS
 
@@ -220,7 +290,7 @@ async def choosing_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    logger.info(f"Data received:\t{query.data}")
+    logger.debug("Data received:\t%s", query.data)
 
     if query.data == "exit":
         await query.edit_message_text("Exited.")
@@ -229,32 +299,13 @@ async def choosing_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
     day = query.data
 
     # Add/remove checkmark of button if pressed.
-    context.user_data["week_dict"][day] = not context.user_data["week_dict"][day]
-
-    # Populate inline keyboard buttons.
-    keyboard = []
-    buttons = []
-    week_dict = context.user_data["week_dict"]
-
-    for k, v in week_dict.items():
-        if v == True:
-            buttons.append(InlineKeyboardButton(f"✅ {k}", callback_data=k))
-        else:
-            buttons.append(InlineKeyboardButton(f"{k}", callback_data=k))
-
-    # Add Save and Exit buttons at the end.
-    buttons.append(InlineKeyboardButton("Save", callback_data="save"))
-    buttons.append(InlineKeyboardButton("Exit", callback_data="exit"))
-
-    # Prepare and set button placement, alignment.
-    keyboard = [buttons[i : i + 3] for i in range(0, 9, 3)]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    days_mask: int = context.user_data.get("days_mask", 0) ^ (1 << WEEKDAYS[day])
+    context.user_data["days_mask"] = days_mask
 
-    logger.info(context.user_data)
+    logger.debug("Days mask of %s: %s", query.from_user.id, days_mask)
 
     await query.edit_message_text(
-        "Choose your laundry days.", reply_markup=reply_markup
+        "Choose your laundry days.", reply_markup=DAY_KEYBOARDS[days_mask]
     )
     return ADDING_DAYS
 
@@ -265,10 +316,10 @@ async def save(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await query.answer()
 
-    week_dict = context.user_data["week_dict"]
+    days_mask: int = context.user_data.get("days_mask", 0)
 
     db = LaundryDB()
-    db.save_day(user_id, week_dict)
+    db.save_day(user_id, days_mask)
     db.close()
 
     await query.edit_message_text("Saved laundry days.")
@@ -305,101 +356,180 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return EXIT
 
 
-async def today_notify(user_id: int, context: ContextTypes.DEFAULT_TYPE):
+async def refresh_verdicts(context: ContextTypes.DEFAULT_TYPE):
+    # Compute today's verdict once per forecast cell instead of once per user.
+    # Only cells with a user due today and no verdict yet are fetched.
+    logger.info("Refreshing cell verdicts...")
+
+    tz = context.bot.defaults.tzinfo
+    now: dt = shared_transport().now(tz)
+    today: str = now.date().isoformat()
+
     db = LaundryDB()
+    cells: list[str] = db.get_missing_cells(today, weekday_name(now.date()))
+    db.close()
+
+    verdicts: list[tuple[str, bool, str]] = []
+
+    for cell in cells:
+        lon, lat = geohash.decode(cell)
+        forecast = Forecast(lon, lat)
 
-    lon: float = db.get_lon(user_id)
-    lat: float = db.get_lat(user_id)
+        # Fetch off the event loop so handlers keep answering meanwhile.
+        try:
+            can_laba, message = await asyncio.to_thread(
+                profiled_call, "today_verdict", forecast.today_verdict
+            )
+        except Exception as e:
+            logger.error("Could not get verdict for cell %s: %s", cell, e)
+            continue
 
+        verdicts.append((cell, can_laba, message))
+
+    db = LaundryDB()
+    db.save_verdicts(today, verdicts)
     db.close()
 
-    forecast = Forecast(lon, lat)
-    response_str: str = forecast.today()
-    await context.bot.send_message(chat_id=user_id, text=response_str)
+    logger.info("Refreshed verdicts of %d/%d cells.", len(verdicts), len(cells))
 
 
 async def notify(context: ContextTypes.DEFAULT_TYPE):
-    # Get laundry days with laundryDB
+    # Send the precomputed verdicts to users whose laundry day is today
     logger.info("Notifying users...")
 
+    tz = context.bot.defaults.tzinfo
+    now: dt = shared_transport().now(tz)
+    today: str = now.date().isoformat()
+
+    # Cover cells missed by the 05:45 refresh: failed fetches, locations
+    # saved since, or a (re)start after the job ran.
+    await refresh_verdicts(context)
+
     db = LaundryDB()
-    data = db.dump()
+    data = db.get_due_notifications(today, weekday_name(now.date()))
     db.close()
 
-    # Will be a problem in the future if database scales
-    for row in data:
-        user_id = row[0]
-        laundrydays = row[1]
+    notified: int = 0
 
-        if laundrydays == None:
-            logger.warning(f"User {user_id} does not have laundry days.")
-        else:
-            if is_equal(laundrydays):
-                logger.info(f"User {user_id} notified successfully.")
-                await today_notify(user_id, context)
+    for user_id, message in data:
+        if message == None:
+            logger.warning("User %s has no verdict for %s.", user_id, today)
+            continue
+
+        await context.bot.send_message(chat_id=user_id, text=message)
+        logger.info("User %s notified successfully.", user_id)
+        notified += 1
+
+    logger.info("Notified %d/%d due users.", notified, len(data))
 
-    logger.info("All users notified successfully.")
 
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /profile on|off|dump, only for the admin set in ADMIN_ID
+    user_id = update.message.chat_id
+
+    if str(user_id) != os.getenv("ADMIN_ID"):
+        logger.warning("User %s tried to use /profile.", user_id)
+        return
 
-# Responses
-def handle_response(text: str) -> str:  # How bot replies
-    text = text.lower()
+    action: str = context.args[0] if context.args else ""
 
-    return text
+    if action == "on":
+        profiler.start()
+    elif action == "off":
+        profiler.stop()
+    elif action == "dump" and profiler.is_enabled():
+        profiler.dump()
+
+    status: str = "on" if profiler.is_enabled() else "off"
+    await update.message.reply_text(
+        f"Profiling is {status}. Writing to {profiler.PROFILE_DIR}/"
+    )
 
 
 # Messages
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message_type: str = update.message.chat.type
     text: str = update.message.text
-    text = text.lower()
 
-    # Logger
-    logger.info(f'User {update.message.chat.id} in {message_type}: "{text}"')
+    # In groups, only answer messages that mention the bot.
+    mention: str | None = (
+        BOT_USERNAME if message_type in ("group", "supergroup") else None
+    )
+    intent: str | None = match_intent(text, mention)
 
-    if message_type == "group":  # If bot is in a group chat
-        if BOT_USERNAME in text:  # If bot is mentioned
-            new_text: str = text.replace(BOT_USERNAME, "").strip()
-            response: str = handle_response(new_text)
-        else:
-            return
+    # Logger
+    logger.debug(
+        'User %s in %s: "%s" -> %s', update.message.chat.id, message_type, text, intent
+    )
 
-    else:  # If bot is in a private chat
-        response: str = handle_response(text)
+    # Unrecognised chatter is dropped without a reply.
+    if intent == None:
+        return
 
-        if "can i laba" in text:
-            await now_command(update, context)
+    await INTENT_HANDLERS[intent](update, context)
 
-        if "don't share location" in text:
-            await default_user_location(update, context)
 
-        else:
-            logger.info(f"Bot: {response}")
-            await update.message.reply_text(response)
+INTENT_HANDLERS: Final = {
+    "now": now_command,
+    "today": today_command,
+    "week": week_command,
+    "no_location": default_user_location,
+}
 
 
 # Error
 
 
 async def error(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.error(
-        f"Update {update} caused error \n{context.error.with_traceback}\n{context.error}"
+    logger.error("Update %s caused error", update, exc_info=context.error)
+
+
+async def post_init(app: Application):
+    # Called once the bot is initialised, right before polling starts.
+    logger.info(
+        "Ready in %.3fs (imports %.3fs).",
+        timer.perf_counter() - _IMPORT_STARTED,
+        IMPORT_TIME,
     )
 
 
 def main():
-    logger.info("Starting...")
+    init_started: float = timer.perf_counter()
     load_dotenv()
+    setup_logging()
+    logger.info("Starting... Imports took %.3fs.", IMPORT_TIME)
     TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
     tz: timezone = timezone(offset=timedelta(hours=8))
 
     defaults = Defaults(tzinfo=tz)
 
-    app = Application.builder().token(TELEGRAM_TOKEN).defaults(defaults).build()
+    # Only the day mask lives in user_data, so conversation state stays tiny.
+    persistence = PicklePersistence(
+        filepath=os.getenv("STATE_FILE", "conversation_state.pickle"),
+        store_data=PersistenceInput(
+            bot_data=False, chat_data=False, user_data=True, callback_data=False
+        ),
+        update_interval=30,
+    )
+
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .defaults(defaults)
+        .persistence(persistence)
+        .post_init(post_init)
+        .build()
+    )
+
+    if os.getenv("LABA_PROFILE") == "1":
+        profiler.start()
 
     job_queue = app.job_queue
-    notify_job = job_queue.run_daily(notify, time(6, 0, 0, tzinfo=tz))
+    refresh_job = job_queue.run_daily(
+        profiled(refresh_verdicts), time(5, 45, 0, tzinfo=tz)
+    )
+    notify_job = job_queue.run_daily(profiled(notify), time(6, 0, 0, tzinfo=tz))
     # notify_job = job_queue.run_repeating(notify, interval=50, first=10)
 
     # CallbackQueryHandler(A, B) : If B is received from a button, A will be called
@@ -407,22 +537,30 @@ def main():
     # Nested Conversation
     set_days_conv = ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(choosing_day, pattern="^[A-z]{1}[a-z]{2}$ || ^exit$")
+            # Saved days are shown with a Save button, before any day is tapped.
+            CallbackQueryHandler(profiled(save), "^save$"),
+            CallbackQueryHandler(
+                profiled(choosing_day), pattern="^[A-z]{1}[a-z]{2}$ || ^exit$"
+            ),
         ],
         states={
             ADDING_DAYS: [
-                CallbackQueryHandler(choosing_day, pattern="^[A-z]{1}[a-z]{2}$"),
-                CallbackQueryHandler(save, "save"),
+                CallbackQueryHandler(
+                    profiled(choosing_day), pattern="^[A-z]{1}[a-z]{2}$"
+                ),
+                CallbackQueryHandler(profiled(save), "save"),
                 CallbackQueryHandler(exit, "exit"),
             ]
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         map_to_parent={EXIT: EXIT},
+        name="set_days_conv",
+        persistent=True,
     )
 
     # Top Level
     laundrydays_convhandler = ConversationHandler(
-        entry_points=[CommandHandler("laundrydays", laundrydays_command)],
+        entry_points=[CommandHandler("laundrydays", profiled(laundrydays_command))],
         states={
             SELECTING_ACTION: [
                 CallbackQueryHandler(setdays, "setdays"),
@@ -432,25 +570,32 @@ def main():
             SET_DAYS: [set_days_conv],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="laundrydays_conv",
+        persistent=True,
     )
 
     # Commands
-    app.add_handler(CommandHandler("start", start_command))
-    app.add_handler(CommandHandler("now", now_command))
-    app.add_handler(CommandHandler("today", today_command))
+    app.add_handler(CommandHandler("start", profiled(start_command)))
+    app.add_handler(CommandHandler("now", profiled(now_command)))
+    app.add_handler(CommandHandler("today", profiled(today_command)))
+    app.add_handler(CommandHandler("week", profiled(week_command)))
     app.add_handler(CommandHandler("cancel", cancel))
-    app.add_handler(MessageHandler(filters.LOCATION, save_user_location))
+    app.add_handler(CommandHandler("profile", profile_command))
+    app.add_handler(MessageHandler(filters.LOCATION, profiled(save_user_location)))
 
     # Conversations
     app.add_handler(laundrydays_convhandler)
 
     # Messages
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app.add_handler(
+        MessageHandler(filters.TEXT & ~filters.COMMAND, profiled(handle_message))
+    )
 
     # Errors
     app.add_error_handler(error)
 
     # Polling
+    logger.info("Built application in %.3fs.", timer.perf_counter() - init_started)
     logger.info("Polling...")
     app.run_polling(poll_interval=1, allowed_updates=Update.ALL_TYPES)
 
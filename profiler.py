@@ -0,0 +1,234 @@
+import os
+import sys
+import time
+import atexit
+import pstats
+import cProfile
+import logging
+import functools
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+"""
+    Opt-in profiling of handlers and jobs.
+
+    Enable at startup with LABA_PROFILE=1 or at runtime with /profile on (admin only).
+    Output goes to LABA_PROFILE_DIR (default: profiles/):
+        <handler>.prof   cProfile stats per handler, open with pstats or snakeviz
+        stacks.folded    sampled stacks in collapsed format, for flamegraph.pl or speedscope
+
+    Handlers are stepped one resume at a time, so profiles and samples only
+    cover time a handler actually runs, not other tasks that run while it
+    awaits. Work handed to worker threads is only captured when it goes
+    through profiled_call(), e.g. asyncio.to_thread(profiled_call, name, fn).
+
+    When disabled, profiled() handlers only pay one boolean check per call.
+"""
+
+PROFILE_DIR: str = os.getenv("LABA_PROFILE_DIR", "profiles")
+SAMPLE_INTERVAL: float = float(os.getenv("LABA_PROFILE_INTERVAL", "0.005"))
+
+_enabled: bool = False
+_profiles: dict[str, cProfile.Profile] = dict()
+_thread_stats: dict[str, pstats.Stats] = dict()  # Merged profiled_call() runs
+_thread_stats_lock = threading.Lock()
+_stepping: bool = False  # A profiled handler is running right now
+_busy_threads: set[int] = set()  # Worker threads inside profiled_call()
+_sampler = None
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stack of the event loop thread while a profiled handler is
+    running (not awaiting), and of worker threads inside profiled_call(),
+    and counts identical stacks.
+    """
+
+    def __init__(self, thread_id: int, interval: float) -> None:
+        super().__init__(name="StackSampler", daemon=True)
+        self.thread_id: int = thread_id
+        self.interval: float = interval
+        self.counts: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            thread_ids: list[int] = list(_busy_threads)
+            if _stepping:
+                thread_ids.append(self.thread_id)
+
+            if not thread_ids:
+                continue
+
+            frames = sys._current_frames()
+
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                stack: list[str] = []
+
+                while frame != None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+
+                if stack:
+                    self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def start() -> None:
+    # Must be called from the event loop thread.
+    global _enabled, _sampler
+
+    if _enabled:
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    _sampler = StackSampler(threading.get_ident(), SAMPLE_INTERVAL)
+    _sampler.start()
+    _enabled = True
+
+    # Registered after setup_logging(), so it runs before the log listener
+    # stops and the shutdown messages still get written.
+    atexit.unregister(stop)
+    atexit.register(stop)
+
+    logger.info("Profiling enabled. Writing to %s/", PROFILE_DIR)
+
+
+def stop() -> None:
+    global _enabled, _sampler
+
+    if not _enabled:
+        return
+
+    _enabled = False
+    _sampler.stop()
+    dump()
+    _sampler = None
+
+    logger.info("Profiling disabled.")
+
+
+def dump() -> None:
+    """
+    Writes per-handler cProfile stats and the sampled stacks to PROFILE_DIR.
+    """
+    for name, profile in _profiles.items():
+        profile.dump_stats(os.path.join(PROFILE_DIR, f"{name}.prof"))
+
+    with _thread_stats_lock:
+        for name, stats in _thread_stats.items():
+            stats.dump_stats(os.path.join(PROFILE_DIR, f"{name}.prof"))
+
+    if _sampler != None:
+        with open(os.path.join(PROFILE_DIR, "stacks.folded"), "a") as f:
+            for stack, count in _sampler.counts.items():
+                f.write(f"{stack} {count}\n")
+        _sampler.counts.clear()
+
+    logger.info(
+        "Dumped %d profiles to %s/", len(_profiles) + len(_thread_stats), PROFILE_DIR
+    )
+
+
+class _Step:
+    """
+    Awaitable that hands a value yielded by the profiled coroutine to the
+    event loop, so the wrapper can await it outside of the profile.
+    """
+
+    def __init__(self, value) -> None:
+        self.value = value
+
+    def __await__(self):
+        return (yield self.value)
+
+
+def profiled(func):
+    """
+    Decorator for async handlers and job callbacks.
+    """
+    name: str = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        global _stepping
+
+        # Nested profiled calls are already covered by the outer profile.
+        if not _enabled or _stepping:
+            return await func(*args, **kwargs)
+
+        profile: cProfile.Profile | None = _profiles.get(name)
+        if profile == None:
+            profile = _profiles[name] = cProfile.Profile()
+        coro = func(*args, **kwargs)
+        started: float = time.perf_counter()
+
+        value = None
+        error: BaseException | None = None
+
+        try:
+            while True:
+                # Profile one step of the handler, up to its next await.
+                _stepping = True
+                profile.enable()
+                try:
+                    if error == None:
+                        yielded = coro.send(value)
+                    else:
+                        yielded = coro.throw(error)
+                except StopIteration as result:
+                    return result.value
+                finally:
+                    profile.disable()
+                    _stepping = False
+
+                # Wait outside the profile; other tasks run meanwhile.
+                try:
+                    value, error = await _Step(yielded), None
+                except BaseException as e:
+                    value, error = None, e
+
+        finally:
+            coro.close()
+            logger.debug("%s took %.4fs", name, time.perf_counter() - started)
+
+    return wrapper
+
+
+def profiled_call(name: str, func, *args, **kwargs):
+    """
+    Runs a blocking callable, profiled under name when profiling is enabled.
+    Meant for worker threads, which the handler profiles don't see.
+    Each call gets its own cProfile, merged into <name>.prof.
+    """
+    if not _enabled:
+        return func(*args, **kwargs)
+
+    thread_id: int = threading.get_ident()
+    profile = cProfile.Profile()
+
+    _busy_threads.add(thread_id)
+    profile.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.disable()
+        _busy_threads.discard(thread_id)
+
+        with _thread_stats_lock:
+            if name in _thread_stats:
+                _thread_stats[name].add(profile)
+            else:
+                _thread_stats[name] = pstats.Stats(profile)
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from datetime import datetime as dt, tzinfo
+
+logger = logging.getLogger(__name__)
+
+"""
+    Forecast transports. Forecast only needs get(url) -> decoded JSON and now(tz).
+
+    HttpTransport       - live Open-Meteo calls (default)
+    RecordingTransport  - wraps another transport and saves every response to disk
+    ReplayTransport     - serves saved responses offline, with simulated latency
+
+    Select with env vars:
+        FORECAST_RECORD_DIR=recordings            record live responses
+        FORECAST_REPLAY_DIR=recordings            replay recorded responses
+        FORECAST_REPLAY_LATENCY=0.2               seconds added to each replayed call
+        FORECAST_REPLAY_SESSION=<session>         run to replay, defaults to the latest
+
+    Each recording run (session) gets its own subdirectory:
+        <dir>/<session>/clock.jsonl     every now() value, in call order
+        <dir>/<session>/<sha1(url)>.json
+"""
+
+CLOCK_FILE = "clock.jsonl"
+
+
+def _recording_path(directory: str, url: str) -> str:
+    key: str = hashlib.sha1(url.encode()).hexdigest()
+    return os.path.join(directory, f"{key}.json")
+
+
+class HttpTransport:
+    def __init__(self, timeout: float = 10.0) -> None:
+        self.timeout: float = timeout
+        self._session = None
+
+    def get(self, url: str) -> dict:
+        # requests is imported on the first call to keep startup fast.
+        # The session keeps the connection to Open-Meteo alive between calls.
+        if self._session == None:
+            import requests
+
+            self._session = requests.Session()
+
+        response = self._session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def now(self, tz: tzinfo) -> dt:
+        return dt.now(tz=tz)
+
+
+class RecordingTransport:
+    def __init__(self, directory: str, inner=None, session: str | None = None) -> None:
+        self.inner = inner if inner != None else HttpTransport()
+        # One subdirectory per process, so runs never overwrite each other.
+        self.session: str = session or dt.now().strftime("%Y%m%dT%H%M%S")
+        self.directory: str = os.path.join(directory, self.session)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, url: str) -> dict:
+        body: dict = self.inner.get(url)
+
+        with open(_recording_path(self.directory, url), "w") as f:
+            json.dump({"url": url, "body": body}, f)
+
+        logger.debug("Recorded %s", url)
+        return body
+
+    def now(self, tz: tzinfo) -> dt:
+        # Every clock value handed out is replayed in the same order.
+        now: dt = self.inner.now(tz)
+
+        with open(os.path.join(self.directory, CLOCK_FILE), "a") as f:
+            f.write(json.dumps(now.isoformat()) + "\n")
+
+        return now
+
+
+class ReplayTransport:
+    def __init__(
+        self,
+        directory: str,
+        latency: float = 0.0,
+        clock: dt | None = None,
+        session: str | None = None,
+    ) -> None:
+        """
+        session: recording run to replay. Defaults to the latest.
+        clock: fixed time replayed forecasts see as "now". By default now()
+        replays the recorded clock values in order, wrapping around at the
+        end, so URLs built from them (start_hour/end_hour) match the run.
+        """
+        self.latency: float = latency
+        self.clock: dt | None = clock
+
+        if session == None:
+            sessions: list[str] = sorted(
+                name
+                for name in os.listdir(directory)
+                if os.path.isdir(os.path.join(directory, name))
+            )
+            if not sessions:
+                raise FileNotFoundError(f"No recording sessions in {directory}")
+            session = sessions[-1]
+
+        self.session: str = session
+        self.directory: str = os.path.join(directory, session)
+
+        if not os.path.isdir(self.directory):
+            raise ValueError(f"No recordings of session {session} in {directory}")
+
+        self._clocks: list[dt] = []
+        self._next_clock: int = 0
+
+        clock_path: str = os.path.join(self.directory, CLOCK_FILE)
+        if os.path.exists(clock_path):
+            with open(clock_path) as f:
+                self._clocks = [dt.fromisoformat(json.loads(line)) for line in f]
+
+    def get(self, url: str) -> dict:
+        path: str = _recording_path(self.directory, url)
+
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No recording of {url} in {self.directory}")
+
+        with open(path) as f:
+            body: dict = json.load(f)["body"]
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        return body
+
+    def now(self, tz: tzinfo) -> dt:
+        if self.clock != None:
+            return self.clock.astimezone(tz)
+
+        if not self._clocks:
+            return dt.now(tz=tz)
+
+        now: dt = self._clocks[self._next_clock]
+        self._next_clock = (self._next_clock + 1) % len(self._clocks)
+
+        return now.astimezone(tz)
+
+
+def default_transport():
+    record_dir: str | None = os.getenv("FORECAST_RECORD_DIR")
+    replay_dir: str | None = os.getenv("FORECAST_REPLAY_DIR")
+
+    if replay_dir:
+        latency: float = float(os.getenv("FORECAST_REPLAY_LATENCY", "0"))
+        logger.info("Replaying forecasts from %s (%ss latency)", replay_dir, latency)
+        session: str | None = os.getenv("FORECAST_REPLAY_SESSION")
+        return ReplayTransport(replay_dir, latency, session=session)
+
+    if record_dir:
+        logger.info("Recording forecasts to %s", record_dir)
+        return RecordingTransport(record_dir)
+
+    return HttpTransport()
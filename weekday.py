@@ -1,20 +1,23 @@
-from datetime import datetime as dt
+from datetime import date
 
 WEEKDAYS = {"Mon": 0, "Tue": 1, "Wed": 2, "Thu": 3, "Fri": 4, "Sat": 5, "Sun": 6}
 
 
-def is_equal(laundrydays: str) -> bool:
-    # Convert laundry days string into a list
-    laundrydays_list = laundrydays.split()
+def weekday_name(day: date) -> str:
+    # Inverse of WEEKDAYS, e.g. Monday -> "Mon"
+    return list(WEEKDAYS)[day.weekday()]
 
-    # Convert weekdays from string to int
-    for i, day in enumerate(laundrydays_list):
-        laundrydays_list[i] = WEEKDAYS[day]
 
-    # Get current weekday
-    curr_weekday = dt.weekday(dt.now())
+def days_to_mask(laundrydays: str) -> int:
+    # "Mon Wed" -> 0b0000101, bit i set if WEEKDAYS day i is selected
+    mask = 0
 
-    if curr_weekday in laundrydays_list:
-        return True
+    for day in laundrydays.split():
+        mask |= 1 << WEEKDAYS[day]
 
-    return False
+    return mask
+
+
+def mask_to_days(mask: int) -> str:
+    # 0b0000101 -> "Mon Wed"
+    return " ".join(day for day, i in WEEKDAYS.items() if mask & (1 << i))